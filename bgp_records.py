@@ -0,0 +1,57 @@
+# format is: <dump-type>|<elem-type>|<record-ts>|<project>|<collector>|<peer-ASn>|<peer-IP>|
+# <prefix>|<next-hop-IP>|<AS-path>|<origin-AS>|<communities>|<old-state>|<new-state>|<validity-state>
+FIELDS = ('dump_type', 'elem_type', 'timestamp', 'project', 'collector', 'peer_asn', 'peer_ip',
+          'prefix', 'next_hop', 'as_path', 'origin', 'communities', 'old_state', 'new_state', 'vstate')
+FIELD_TYPES = {'timestamp': int, 'vstate': int}
+PREFIX_INDEX = FIELDS.index('prefix')
+RIB_ENTRY = b'R|R'
+
+
+def decode_records(lines, fields, prefixes=None, record_types=(RIB_ENTRY,)):
+    """
+    :param lines: Iterable of lines as bytes, e.g. a file opened in binary mode
+    :param fields: Names of the fields to return, see FIELDS. timestamp and vstate are returned as int, all other
+    fields as str
+    :param prefixes: If given, only records for these prefixes are returned
+    :param record_types: If given, only records that start with one of these '<dump-type>|<elem-type>' are returned
+    :return: Generator of tuples with the requested fields. Other lines with too few fields are skipped, but RIB entries
+    with too few fields raise a ValueError, e.g. if vstate is requested from data that is not annotated
+    """
+    indices = [FIELDS.index(field) for field in fields]
+    converters = [FIELD_TYPES.get(field, bytes.decode) for field in fields]
+    fields_and_converters = list(zip(indices, converters))
+    last_index = max(indices + [PREFIX_INDEX])
+    if prefixes is not None:
+        prefixes = set(prefix if isinstance(prefix, bytes) else prefix.encode() for prefix in prefixes)
+    if record_types is not None:
+        record_types = set(record_types)
+
+    for line in lines:
+        if record_types is not None and line[:3] not in record_types:
+            continue
+        values = line.split(b'|', last_index + 1)
+        if len(values) <= last_index:
+            if line[:3] == RIB_ENTRY:
+                hint = ". Is the data annotated with validity states?" if 'vstate' in fields else ""
+                raise ValueError("RIB entry has {0} fields, {1} needed{2}: {3!r}".format(len(values), last_index + 1,
+                                                                                         hint, line))
+            continue
+        if prefixes is not None and values[PREFIX_INDEX] not in prefixes:
+            continue
+        if len(values) == last_index + 1:
+            values[last_index] = values[last_index].rstrip()
+        yield tuple([convert(values[index]) for index, convert in fields_and_converters])
+
+
+def is_valid_bgp_entry(prefix, as_path, origin):
+    """
+    Same checks as reuter_util.bgp.is_valid_bgp_entry, on decoded fields
+    :return: True if origin and as_path are valid values
+    """
+    if origin == "" or origin == "0" or origin[0] == '{':
+        return False
+    if as_path == "":
+        return False
+    if prefix == "0.0.0.0/0":
+        return False
+    return True
@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
-import yaml
 import sys
 import argparse
 import os
 import time
-from _pybgpstream import BGPStream, BGPElem, BGPRecord
+import pickle
+import hashlib
 from datetime import datetime, timedelta
 from reuter_util import bgp
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import bgp_records
 from calendar import timegm
 from collections import defaultdict
 import json
-import psycopg2
+from result_sinks import PostgresSink, SQLiteSink
 
 
 def timeit(method):
@@ -30,60 +32,115 @@ def parse_arguments(args):
     parser = argparse.ArgumentParser()
     parser.add_argument("experiment_configs", help="Directory with YAML experiment config files")
     parser.add_argument("day", help="Day to analyse data from. Format %Y-%m-%d")
-    parser.add_argument("db_config", help="db_config.json")
-    return parser.parse_args(args)
+    parser.add_argument("db_config", nargs='?', help="db_config.json of the Postgres DB to write results to")
+    parser.add_argument("--sqlite", help="Write results to this SQLite database file instead of Postgres")
+    parser.add_argument("--route-changes", action="store_true", help="Store only changes of VP routes instead of a "
+                                                                      "raw_data row per RIB entry")
+    parser.add_argument("--ribs", help="Read BGP data from this bgpreader dump instead of BGPStream")
+    args = parser.parse_args(args)
+    if args.db_config is None and args.sqlite is None:
+        parser.error("db_config or --sqlite is required")
+    return args
 
 
-def read_experiment_config_files(config_file_dir):
-    config_files = {}
-    config_filenames = os.listdir(config_file_dir)
-    for config_file in config_filenames:
-        if config_file.endswith('.yaml'):
-            fd = open(config_file_dir + '/' + config_file, 'r')
-            config_file = yaml.load(fd)
-            config_files[config_file['experiment_id']] = config_file
-            fd.close()
-    return config_files
+# Increase when compile_experiment_config changes, so that cached configs are compiled again
+CONFIG_CACHE_VERSION = 1
 
 
-def raw_data_to_str(rd):
-    comm = rd[10]
-    if comm != 'NULL':
-        comm = "'{0}'".format(comm)
+def parse_roa_period_time(str_time):
+    """
+    :param str_time: Time of day of a ROA period, e.g. '04:00 UTC', or '-' if the ROA is always active
+    :return: Seconds since midnight, None for '-'
+    """
+    if str_time == '-':
+        return None
+    time_of_day = datetime.strptime(str_time, "%H:%M %Z")
+    return time_of_day.hour * 3600 + time_of_day.minute * 60
 
-    args = "'{0}', {1}, '{2}', '{3}', {4}, '{5}', '{6}', '{7}', {8}, {9}, {10}".format(rd[0], rd[1], rd[2],
-                                                                                       rd[3], rd[4], rd[5],
-                                                                                       rd[6], rd[7], rd[8],
-                                                                                       rd[9], comm)
-    return args
 
+def compile_experiment_config(config):
+    """
+    Adds pre-parsed forms of the config to it: 'prefix_set', 'pairs' as list((anchor, experiment)) and 'roa_periods'
+    as prefix->list((asn, start, end)), see parse_roa_period_time
+    """
+    config['prefix_set'] = frozenset(config['prefixes'])
+    config['pairs'] = [(prefix_pair['anchor'], prefix_pair['experiment']) for prefix_pair in config['prefix_pairs']]
+    config['roa_periods'] = {}
+    for prefix, roas in config['roas'].items():
+        config['roa_periods'][prefix] = [(roa['asn'], parse_roa_period_time(roa['period']['start']),
+                                          parse_roa_period_time(roa['period']['end'])) for roa in roas]
+    return config
 
-def analysis_results_to_str(res):
-    return "'{0}', {1}, '{2}', '{3}', '{4}'".format(res[0], res[1], res[2], res[3], res[4])
 
+def load_experiment_config_file(filename):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(filename, 'r') as fd:
+        return compile_experiment_config(yaml.load(fd, Loader=loader))
 
-def get_connect_str_from_config(db_config):
-    return "dbname='{0}' user='{1}' host='{2}' password='{3}' port='{4}'".format(db_config['db_name'],
-                                                                                 db_config['db_user'],
-                                                                                 db_config['db_host'],
-                                                                                 db_config['db_pwd'],
-                                                                                 db_config['db_port'])
 
+def get_config_cache_filename(config_file_dir):
+    """
+    :return: File in the user's cache directory for the compiled configs of config_file_dir
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    dir_hash = hashlib.sha1(os.path.abspath(config_file_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, 'rov-measurement', 'experiment_configs_' + dir_hash + '.pickle')
+
+
+def read_experiment_config_files(config_file_dir):
+    """
+    Compiled configs are cached in the user's cache directory and only re-read from YAML if a file's mtime or size or
+    CONFIG_CACHE_VERSION changed. The cache is unpickled, so it must not be shared with or writable by other users.
+    :return: Dictionary experiment_id->compiled config, see compile_experiment_config
+    """
+    cache_filename = get_config_cache_filename(config_file_dir)
+    try:
+        with open(cache_filename, 'rb') as f:
+            version, cache = pickle.load(f)
+        if version != CONFIG_CACHE_VERSION:
+            cache = {}
+    except Exception:
+        cache = {}
+
+    config_files = {}
+    new_cache = {}
+    for config_file in sorted(os.listdir(config_file_dir)):
+        if config_file.endswith('.yaml'):
+            filename = os.path.join(config_file_dir, config_file)
+            stat = os.stat(filename)
+            key = (stat.st_mtime_ns, stat.st_size)
+            if config_file in cache and cache[config_file][0] == key:
+                config = cache[config_file][1]
+            else:
+                config = load_experiment_config_file(filename)
+            new_cache[config_file] = (key, config)
+            config_files[config['experiment_id']] = config
+
+    if new_cache.keys() != cache.keys() or any(new_cache[name][0] != cache[name][0] for name in new_cache):
+        try:
+            os.makedirs(os.path.dirname(cache_filename), mode=0o700, exist_ok=True)
+            with open(cache_filename, 'wb') as f:
+                pickle.dump((CONFIG_CACHE_VERSION, new_cache), f, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+    return config_files
 
-def add_missing_routes(config_files, vp_routes, day):
-    for vp in vp_routes:
-        for exp_id in config_files:
-            config = config_files[exp_id]
-            for prefix_pair in config['prefix_pairs']:
-                p_a = prefix_pair['anchor']
-                p_e = prefix_pair['experiment']
 
-                for timestamp in vp_routes[vp][p_a]:
-                    if timestamp not in vp_routes[vp][p_e]:
-                        vp_routes[vp][p_e][timestamp] = 'missing'
+def add_missing_routes(config_files, routes):
+    """
+    :param routes: Routes of one VP as prefix->timestamp->AS path
+    """
+    for exp_id in config_files:
+        config = config_files[exp_id]
+        for p_a, p_e in config['pairs']:
+            for timestamp in routes[p_a]:
+                if timestamp not in routes[p_e]:
+                    routes[p_e][timestamp] = 'missing'
 
 
 def init_stream(config_files, start_time, end_time):
+    from _pybgpstream import BGPStream, BGPRecord
     stream = BGPStream()
     rec = BGPRecord()
     stream.add_filter('project', 'ris')
@@ -102,7 +159,7 @@ def get_bgp_data_from_stream(config_files, start, end):
     all_experiment_prefixes = set()
     for exp_id in config_files:
         config_file = config_files[exp_id]
-        all_experiment_prefixes.update(config_file['prefixes'])
+        all_experiment_prefixes.update(config_file['prefix_set'])
     stream, rec = init_stream(config_files, start, end)
     stream.start()
 
@@ -142,50 +199,44 @@ def get_bgp_data_from_file(config_files, filename):
     all_experiment_prefixes = set()
     for exp_id in config_files:
         config_file = config_files[exp_id]
-        all_experiment_prefixes.update(config_file['prefixes'])
-
-    with open(filename, 'r') as f:
-        for line in f:
-            if line[:3] == "R|R":
-                line = line.split('|')
-                peer_asn = int(line[5])
-                peer_address = line[6]
-                vp = (peer_asn, peer_address)
-                prefix = line[7]
-                as_path = line[9]
-                as_path = bgp.remove_prepending_from_as_path(as_path)
-                path_len = len(as_path.split(' '))
-                origin_asn = int(line[10])
-                communities = line[11]
-                timestamp = int(line[2])
-                timestamp = timestamp - (timestamp % 3600)
-                day = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
-                collector = line[4]
-                project = line[3]
-
-                if communities == "":
-                    communities = 'NULL'
-
-                if prefix in all_experiment_prefixes:
-                    vp_routes[vp][prefix][timestamp] = as_path
-                    raw_data.append((day, timestamp, project, collector, peer_asn, peer_address, prefix,
-                                     as_path, path_len, origin_asn, communities))
+        all_experiment_prefixes.update(config_file['prefix_set'])
+
+    record_fields = ['timestamp', 'project', 'collector', 'peer_asn', 'peer_ip', 'prefix', 'as_path', 'origin',
+                     'communities']
+    with open(filename, 'rb') as f:
+        for (timestamp, project, collector, peer_asn, peer_address, prefix, as_path, origin_asn,
+             communities) in bgp_records.decode_records(f, record_fields, all_experiment_prefixes):
+            peer_asn = int(peer_asn)
+            vp = (peer_asn, peer_address)
+            as_path = bgp.remove_prepending_from_as_path(as_path)
+            path_len = len(as_path.split(' '))
+            origin_asn = int(origin_asn)
+            timestamp = timestamp - (timestamp % 3600)
+            day = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+            if communities == "":
+                communities = 'NULL'
+
+            vp_routes[vp][prefix][timestamp] = as_path
+            raw_data.append((day, timestamp, project, collector, peer_asn, peer_address, prefix,
+                             as_path, path_len, origin_asn, communities))
 
     return raw_data, vp_routes
 
 
 def get_expected_rpki_status(prefix, origin_asn, timestamp, config, day):
-    roas = config['roas'][prefix]
+    roas = config['roa_periods'][prefix]
     prop_time = 0
-    for roa in roas:
+    midnight = timegm(datetime.strptime(day, '%Y-%m-%d').utctimetuple())
+    for asn, start, end in roas:
 
-        str_start = roa['period']['start']
-        str_end = roa['period']['end']
-        start = datetime.strptime(day + ' ' + str_start, "%Y-%m-%d %H:%M %Z")
-        end = datetime.strptime(day + ' ' + str_end, "%Y-%m-%d %H:%M %Z")
+        if start is None or end is None:
+            if asn == origin_asn:
+                return 'VALID'
+            continue
 
-        u_start = timegm(start.utctimetuple())
-        u_end = timegm(end.utctimetuple())
+        u_start = midnight + start
+        u_end = midnight + end
 
         roa_is_active = False
         if u_start < u_end:
@@ -196,7 +247,7 @@ def get_expected_rpki_status(prefix, origin_asn, timestamp, config, day):
             if u_start + prop_time < timestamp or timestamp <= u_end + prop_time:
                 roa_is_active = True
 
-        if roa['asn'] == origin_asn and roa_is_active:
+        if asn == origin_asn and roa_is_active:
             return 'VALID'
 
     if roas:
@@ -204,135 +255,119 @@ def get_expected_rpki_status(prefix, origin_asn, timestamp, config, day):
     return 'UNKNOWN'
 
 
-def analyze_experiment5(config, vp_routes, day):
+def analyze_experiment5(config, vp, routes, day):
+    vp_asn = vp[0]
+    vp_ip = vp[1]
+    direct_route = str(vp_asn) + ' ' + str(config['origin_asn'])
     case1_results = []
-    for vp in vp_routes:
-        vp_asn = vp[0]
-        vp_ip = vp[1]
-        direct_route = str(vp_asn) + ' 47065'
-        for prefix_pair in config['prefix_pairs']:
-            p_a = prefix_pair['anchor']
-            p_e = prefix_pair['experiment']
-            routes = vp_routes[vp]
-            if p_a not in routes:
-                continue
+    for p_a, p_e in config['pairs']:
+        if p_a not in routes:
+            continue
 
-            # If VP has constant, direct, route to p_a..
-            if all(vp_routes[vp][p_a][timestamp] == direct_route for timestamp in vp_routes[vp][p_a]):
-                if not all(vp_routes[vp][p_e][timestamp] == direct_route for timestamp in vp_routes[vp][p_e]):
-                    # CASE 1: VP has constant, direct route to P_a, but not to P_e
-                    case1_result = (day, vp_asn, vp_ip, p_a, p_e)
-                    case1_results.append(case1_result)
+        # If VP has constant, direct, route to p_a..
+        if all(path == direct_route for path in routes[p_a].values()):
+            if not all(path == direct_route for path in routes[p_e].values()):
+                # CASE 1: VP has constant, direct route to P_a, but not to P_e
+                case1_result = (day, vp_asn, vp_ip, p_a, p_e)
+                case1_results.append(case1_result)
 
     return case1_results
 
 
-def update_marked_vp_stats(connect_str):
-    try:
-        conn = psycopg2.connect(connect_str)
-        cursor = conn.cursor()
-
-        sql_select = "SELECT vp_asn, vp_ip FROM exp5_case_1;"
-        cursor.execute(sql_select)
-        vps = set(cursor.fetchall())
-
-        for (vp_asn, vp_ip) in vps:
-
-            # Get all data dates:
-            sql_select = "SELECT DISTINCT day FROM raw_data WHERE (vp_asn = {0} AND vp_ip = '{1}')".format(vp_asn, vp_ip)
-            cursor.execute(sql_select)
-            data_dates = set([res[0] for res in cursor.fetchall()])
-            latest_measured = max(data_dates).strftime("%Y-%m-%d")
-
-            # Get all marked dates:
-            sql_select = "SELECT DISTINCT day FROM exp5_case_1 WHERE (vp_asn = {0} AND vp_ip = '{1}')".format(vp_asn, vp_ip)
-            cursor.execute(sql_select)
-            marked_dates = set([res[0] for res in cursor.fetchall()])
-            latest_marked = max(marked_dates).strftime("%Y-%m-%d")
-
-            marked_ratio = len(marked_dates)/float(len(data_dates))
-            sql_insert_stats = "INSERT INTO exp5_case_1_vp_stats VALUES "
-            sql_insert_stats += "({0}, '{1}', {2}, {3}, {4}, '{5}', '{6}')".format(vp_asn, vp_ip, len(data_dates),
-                                                                                   len(marked_dates), marked_ratio,
-                                                                                   latest_measured, latest_marked)
-            sql_insert_stats += " ON CONFLICT ON CONSTRAINT vp_unique "
-            sql_insert_stats += " DO UPDATE SET data_dates = {0},".format(len(data_dates))
-            sql_insert_stats += " marked_dates = {0},".format(len(marked_dates))
-            sql_insert_stats += " marked_ratio = {0},".format(marked_ratio)
-            sql_insert_stats += " last_marked = '{0}',".format(latest_marked)
-            sql_insert_stats += " last_measured = '{0}';".format(latest_measured)
-            cursor.execute(sql_insert_stats)
-
-            sql_select = "SELECT anchor_prefix, experiment_prefix FROM exp5_case_1 "
-            sql_select += "WHERE (vp_asn = {0} AND vp_ip = '{1}' AND day = '{2}');".format(vp_asn, vp_ip, latest_marked)
-            cursor.execute(sql_select)
-            prefixes = cursor.fetchall()
-            notes = ""
-            if ('147.28.243.0/24', '147.28.245.0/24') in prefixes:
-                notes += "Filtering Via AMSIX Route Server;"
-
-            if ('147.28.242.0/24', '147.28.244.0/24') in prefixes:
-                notes += "Filtering Via AMSIX Falcon Route Server;"
-
-            if ('147.28.246.0/24', '147.28.247.0/24') in prefixes:
-                notes += "Filtering;"
-
-            if ('147.28.248.0/24', '147.28.249.0/24') in prefixes:
-                notes += "Filtering;"
-
-            sql_update = "UPDATE exp5_case_1_vp_stats "
-            sql_update += "SET notes = '{0}' WHERE (vp_asn = {1} AND vp_ip = '{2}');".format(notes, vp_asn, vp_ip)
-            cursor.execute(sql_update)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+def update_marked_vp_stats(sink, config, tablename):
+    """
+    Updates <tablename>_vp_stats for the VPs marked in the result table tablename. The notes of a VP are those of the
+    prefix pairs it was marked for on its latest marked day, in the order of prefix_pairs in config.
+    """
+    for (vp_asn, vp_ip) in sink.marked_vps(tablename):
 
-    except Exception as e:
-        print("ERROR: Can't connect to DB.")
-        print(e)
-        exit()
-
-
-def insert_into_db_table(args_str, tablename, connect_str):
-    try:
-        conn = psycopg2.connect(connect_str)
-        cursor = conn.cursor()
-        for arg in args_str:
-            sql_insert = "INSERT INTO " + tablename + " VALUES (" + arg + ")"
-            cursor.execute(sql_insert)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print("ERROR: Can't connect to DB.")
-        print(e)
-        exit()
+        # Get all data dates:
+        data_dates = sink.data_days(vp_asn, vp_ip)
+        latest_measured = max(data_dates)
 
+        # Get all marked dates:
+        marked_dates = sink.marked_days(tablename, vp_asn, vp_ip)
+        latest_marked = max(marked_dates)
 
-def main(args):
-    args = parse_arguments(args)
-    config_files = read_experiment_config_files(args.experiment_configs)
+        marked_ratio = len(marked_dates)/float(len(data_dates))
 
-    #raw_data, vp_routes = get_bgp_data_from_file(config_files, 'data/2018-01-01-exp5.ribs')
-
-    midnight = timegm(datetime.strptime(args.day, '%Y-%m-%d').utctimetuple())
-    next_midnight = midnight + (60 * 60 * 24)
-    raw_data, vp_routes = get_bgp_data_from_stream(config_files, midnight, next_midnight - 1)
+        prefixes = sink.marked_prefix_pairs(tablename, vp_asn, vp_ip, latest_marked)
+        notes = ""
+        for prefix_pair in config['prefix_pairs']:
+            if 'note' in prefix_pair and (prefix_pair['anchor'], prefix_pair['experiment']) in prefixes:
+                notes += prefix_pair['note'] + ";"
+
+        sink.upsert_vp_stats(tablename + '_vp_stats', vp_asn, vp_ip, len(data_dates), len(marked_dates), marked_ratio,
+                             latest_measured, latest_marked, notes)
+
+
+# experiment_id->(analyzer, result table, stats updater or None). An analyzer takes the compiled config of its
+# experiment, one VP, the VP's routes as prefix->timestamp->AS path and the day and returns the VP's result rows. The
+# stats updater is called with the sink, the config and the result table after the results of the day have been
+# written.
+EXPERIMENT_ANALYZERS = {
+    5: (analyze_experiment5, 'exp5_case_1', update_marked_vp_stats),
+}
+
+
+def analyze_experiments(config_files, vp_routes, day):
+    """
+    Runs the analyzers of all configured experiments in one pass over vp_routes. Missing routes are added first, see
+    add_missing_routes.
+    :return: Dictionary result table->list of result rows
+    """
+    analyzers = []
+    for exp_id in sorted(config_files):
+        if exp_id not in EXPERIMENT_ANALYZERS:
+            print("No analyzer for experiment {0}, skipping it.".format(exp_id))
+            continue
+        analyzers.append((config_files[exp_id],) + EXPERIMENT_ANALYZERS[exp_id][:2])
+
+    case_results = dict((tablename, []) for config, analyze, tablename in analyzers)
+    for vp, routes in vp_routes.items():
+        add_missing_routes(config_files, routes)
+        for config, analyze, tablename in analyzers:
+            case_results[tablename].extend(analyze(config, vp, routes, day))
+    return case_results
+
+
+def open_sink(args):
+    if args.sqlite:
+        return SQLiteSink(args.sqlite, args.route_changes)
 
     with open(args.db_config, 'r') as f:
         db_config = json.load(f)
+    return PostgresSink(db_config, args.route_changes)
+
 
-    add_missing_routes(config_files, vp_routes, args.day)
-    case1_results = analyze_experiment5(config_files[5], vp_routes, args.day)
+def main(args):
+    args = parse_arguments(args)
+    config_files = read_experiment_config_files(args.experiment_configs)
 
-    insert_into_db_table([raw_data_to_str(rd) for rd in raw_data], 'raw_data', get_connect_str_from_config(db_config))
-    insert_into_db_table([analysis_results_to_str(rd) for rd in case1_results], 'exp5_case_1',
-                         get_connect_str_from_config(db_config))
+    if args.ribs:
+        raw_data, vp_routes = get_bgp_data_from_file(config_files, args.ribs)
+    else:
+        midnight = timegm(datetime.strptime(args.day, '%Y-%m-%d').utctimetuple())
+        next_midnight = midnight + (60 * 60 * 24)
+        raw_data, vp_routes = get_bgp_data_from_stream(config_files, midnight, next_midnight - 1)
 
-    update_marked_vp_stats(get_connect_str_from_config(db_config))
+    case_results = analyze_experiments(config_files, vp_routes, args.day)
 
+    try:
+        sink = open_sink(args)
+        sink.insert_raw_data(raw_data)
+        sink.insert_case_results(case_results)
+        for exp_id in sorted(config_files):
+            if exp_id not in EXPERIMENT_ANALYZERS:
+                continue
+            analyze, tablename, update_stats = EXPERIMENT_ANALYZERS[exp_id]
+            if update_stats is not None:
+                update_stats(sink, config_files[exp_id], tablename)
+        sink.close()
+    except Exception as e:
+        print("ERROR: Can't write results to DB.")
+        print(e)
+        exit()
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))
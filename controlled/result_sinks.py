@@ -0,0 +1,400 @@
+import sqlite3
+from calendar import timegm
+from collections import defaultdict
+from datetime import datetime
+
+
+def raw_data_to_str(rd):
+    comm = rd[10]
+    if comm != 'NULL':
+        comm = "'{0}'".format(comm)
+
+    args = "'{0}', {1}, '{2}', '{3}', {4}, '{5}', '{6}', '{7}', {8}, {9}, {10}".format(rd[0], rd[1], rd[2],
+                                                                                       rd[3], rd[4], rd[5],
+                                                                                       rd[6], rd[7], rd[8],
+                                                                                       rd[9], comm)
+    return args
+
+
+def get_connect_str_from_config(db_config):
+    return "dbname='{0}' user='{1}' host='{2}' password='{3}' port='{4}'".format(db_config['db_name'],
+                                                                                 db_config['db_user'],
+                                                                                 db_config['db_host'],
+                                                                                 db_config['db_pwd'],
+                                                                                 db_config['db_port'])
+
+
+def encode_route_changes(raw_data):
+    """
+    Delta-encodes raw_data rows. A VP is observed at an hour if it had a route to any experiment prefix in that hour.
+    A run is a maximal sequence of observed hours of a VP in which its route to a prefix had the same AS path.
+    :param raw_data: List of raw_data rows, see get_bgp_data_from_file
+    :return: observed_hours: Dictionary (vp_asn, vp_ip)->day->bitmask of observed hours
+    :return: runs: Dictionary (vp_asn, vp_ip, prefix)->list([as_path, path_len, origin_asn, first_seen, last_seen])
+    """
+    observed = defaultdict(set)
+    routes = defaultdict(dict)
+    for rd in raw_data:
+        timestamp, vp = rd[1], (rd[4], rd[5])
+        observed[vp].add(timestamp)
+        routes[vp + (rd[6],)][timestamp] = (rd[7], rd[8], rd[9])
+
+    observed_hours = defaultdict(lambda: defaultdict(int))
+    for vp, timestamps in observed.items():
+        for timestamp in timestamps:
+            day = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+            observed_hours[vp][day] |= 1 << (timestamp % 86400 // 3600)
+
+    runs = defaultdict(list)
+    for key, prefix_routes in routes.items():
+        run = None
+        for timestamp in sorted(observed[key[:2]]):
+            route = prefix_routes.get(timestamp)
+            if route is None:
+                run = None
+            elif run is not None and run[0] == route[0]:
+                run[4] = timestamp
+            else:
+                run = list(route) + [timestamp, timestamp]
+                runs[key].append(run)
+    return observed_hours, runs
+
+
+def hours_to_timestamps(day, hours):
+    midnight = timegm(datetime.strptime(day, '%Y-%m-%d').utctimetuple())
+    return [midnight + hour * 3600 for hour in range(24) if hours >> hour & 1]
+
+
+class RouteChangesStore(object):
+    """
+    Change-only storage of VP routes, as an alternative to a raw_data row per RIB entry. vp_observed_hours keeps a
+    bitmask of the hours each VP was seen per day and vp_route_changes the runs of encode_route_changes. Runs that
+    continue a stored run of the previous data are extended instead of inserted again, so days must be stored in order.
+    Storing the last stored day again replaces it, storing a day before it raises a ValueError.
+    Subclasses provide self.cursor and self.placeholder ('?' or '%s').
+    """
+
+    def _create_route_changes_tables(self):
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS vp_observed_hours (vp_asn BIGINT, vp_ip TEXT, day TEXT, "
+                            "hours INTEGER, CONSTRAINT vp_day_unique UNIQUE (vp_asn, vp_ip, day))")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS vp_route_changes (vp_asn BIGINT, vp_ip TEXT, prefix TEXT, "
+                            "as_path TEXT, path_len INTEGER, origin_asn BIGINT, first_seen BIGINT, "
+                            "last_seen BIGINT)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS vp_route_changes_vp ON vp_route_changes "
+                            "(vp_asn, vp_ip, prefix, last_seen)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS vp_route_changes_time ON vp_route_changes "
+                            "(last_seen, first_seen)")
+
+    def _sql(self, sql):
+        return sql.replace('?', self.placeholder)
+
+    def _last_observed(self, vp_asn, vp_ip, before_day):
+        self.cursor.execute(self._sql("SELECT day, hours FROM vp_observed_hours WHERE vp_asn = ? AND vp_ip = ? "
+                                      "AND day < ? ORDER BY day DESC LIMIT 1"), (vp_asn, vp_ip, before_day))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return hours_to_timestamps(row[0], row[1])[-1]
+
+    def _delete_route_changes_from(self, day):
+        """
+        Removes the stored route changes from day on. Runs that started before day are cut back to the last hour their
+        VP was observed before day.
+        """
+        midnight = timegm(datetime.strptime(day, '%Y-%m-%d').utctimetuple())
+        self.cursor.execute(self._sql("DELETE FROM vp_route_changes WHERE first_seen >= ?"), (midnight,))
+        self.cursor.execute(self._sql("SELECT DISTINCT vp_asn, vp_ip FROM vp_route_changes WHERE last_seen >= ?"),
+                            (midnight,))
+        for vp_asn, vp_ip in self.cursor.fetchall():
+            self.cursor.execute(self._sql("UPDATE vp_route_changes SET last_seen = ? WHERE vp_asn = ? AND vp_ip = ? "
+                                          "AND last_seen >= ?"),
+                                (self._last_observed(vp_asn, vp_ip, day), vp_asn, vp_ip, midnight))
+        self.cursor.execute(self._sql("DELETE FROM vp_observed_hours WHERE day >= ?"), (day,))
+
+    def insert_route_changes(self, raw_data):
+        observed_hours, runs = encode_route_changes(raw_data)
+        if not observed_hours:
+            return
+        first_day = min(min(days) for days in observed_hours.values())
+        last_day = max(max(days) for days in observed_hours.values())
+        self.cursor.execute(self._sql("SELECT MAX(day) FROM vp_observed_hours"))
+        last_stored_day = self.cursor.fetchone()[0]
+        if last_stored_day is not None and last_stored_day > last_day:
+            raise ValueError("Route changes up to {0} are already stored, can't store {1}. Days must be stored in "
+                             "order".format(last_stored_day, last_day))
+        self._delete_route_changes_from(first_day)
+
+        first_observed = {}
+        for vp, days in observed_hours.items():
+            first_day = min(days)
+            first_observed[vp] = (hours_to_timestamps(first_day, days[first_day])[0],
+                                  self._last_observed(vp[0], vp[1], first_day))
+            for day, hours in days.items():
+                self.cursor.execute(self._sql("INSERT INTO vp_observed_hours VALUES (?, ?, ?, ?)"),
+                                    (vp[0], vp[1], day, hours))
+
+        rows = []
+        for (vp_asn, vp_ip, prefix), prefix_runs in runs.items():
+            first_seen, last_observed = first_observed[(vp_asn, vp_ip)]
+            as_path, path_len, origin_asn, run_start, run_end = prefix_runs[0]
+            if run_start == first_seen and last_observed is not None:
+                # Extend the stored run if it lasted until the last hour the VP was observed before
+                self.cursor.execute(self._sql("UPDATE vp_route_changes SET last_seen = ? WHERE vp_asn = ? AND "
+                                              "vp_ip = ? AND prefix = ? AND last_seen = ? AND as_path = ?"),
+                                    (run_end, vp_asn, vp_ip, prefix, last_observed, as_path))
+                if self.cursor.rowcount:
+                    prefix_runs = prefix_runs[1:]
+            for run in prefix_runs:
+                rows.append((vp_asn, vp_ip, prefix) + tuple(run))
+        self.cursor.executemany(self._sql("INSERT INTO vp_route_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)"), rows)
+
+    def route_changes_data_days(self, vp_asn, vp_ip):
+        self.cursor.execute(self._sql("SELECT day FROM vp_observed_hours WHERE vp_asn = ? AND vp_ip = ?"),
+                            (vp_asn, vp_ip))
+        return set([res[0] for res in self.cursor.fetchall()])
+
+    def read_vp_routes(self, day):
+        """
+        Reconstructs the hourly routes of a day from the stored route changes
+        :return: Dictionary vp->prefix->timestamp->as_path, as returned by get_bgp_data_from_file
+        """
+        midnight = timegm(datetime.strptime(day, '%Y-%m-%d').utctimetuple())
+        next_midnight = midnight + (60 * 60 * 24)
+
+        self.cursor.execute(self._sql("SELECT vp_asn, vp_ip, hours FROM vp_observed_hours WHERE day = ?"), (day,))
+        observed = dict(((vp_asn, vp_ip), hours_to_timestamps(day, hours))
+                        for vp_asn, vp_ip, hours in self.cursor.fetchall())
+
+        vp_routes = defaultdict(lambda: defaultdict(dict))
+        self.cursor.execute(self._sql("SELECT vp_asn, vp_ip, prefix, as_path, first_seen, last_seen "
+                                      "FROM vp_route_changes WHERE last_seen >= ? AND first_seen < ?"),
+                            (midnight, next_midnight))
+        for vp_asn, vp_ip, prefix, as_path, first_seen, last_seen in self.cursor.fetchall():
+            vp = (vp_asn, vp_ip)
+            for timestamp in observed.get(vp, []):
+                if first_seen <= timestamp <= last_seen:
+                    vp_routes[vp][prefix][timestamp] = as_path
+        return vp_routes
+
+    def route_at(self, vp, prefix, timestamp):
+        """
+        Runs can span hours and days in which vp was not observed, so the observed hours of the day are checked too,
+        as in read_vp_routes.
+        :return: AS path of vp to prefix at timestamp, None if vp was not observed in that hour or had no route to
+                 prefix then
+        """
+        timestamp = timestamp - (timestamp % 3600)
+        day = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+        self.cursor.execute(self._sql("SELECT hours FROM vp_observed_hours WHERE vp_asn = ? AND vp_ip = ? AND day = ?"),
+                            (vp[0], vp[1], day))
+        row = self.cursor.fetchone()
+        if row is None or not row[0] >> (timestamp % 86400 // 3600) & 1:
+            return None
+
+        self.cursor.execute(self._sql("SELECT as_path, first_seen FROM vp_route_changes WHERE vp_asn = ? AND "
+                                      "vp_ip = ? AND prefix = ? AND last_seen >= ? ORDER BY last_seen LIMIT 1"),
+                            (vp[0], vp[1], prefix, timestamp))
+        row = self.cursor.fetchone()
+        if row is None or row[1] > timestamp:
+            return None
+        return row[0]
+
+    def path_switches(self, vp, start, end):
+        """
+        :return: List of (timestamp, prefix, old_as_path, new_as_path) for each time between start and end that vp
+                 was first seen with a different path to a prefix than before, ordered by timestamp
+        """
+        self.cursor.execute(self._sql("SELECT prefix, as_path, first_seen FROM vp_route_changes WHERE vp_asn = ? AND "
+                                      "vp_ip = ? AND first_seen <= ? ORDER BY prefix, first_seen"),
+                            (vp[0], vp[1], end))
+        switches = []
+        previous_prefix = previous_path = None
+        for prefix, as_path, first_seen in self.cursor.fetchall():
+            if prefix == previous_prefix and as_path != previous_path and first_seen >= start:
+                switches.append((first_seen, prefix, previous_path, as_path))
+            previous_prefix, previous_path = prefix, as_path
+        return sorted(switches)
+
+    def diverged_vps(self, day, prefix_pairs):
+        """
+        Same rule as route_changes_indirect.py: a VP diverged for a prefix pair if on day it had routes to both the
+        anchor and the experiment prefix, and either the sets of AS paths to them or the numbers of hours with a route
+        to them differ.
+        :param prefix_pairs: List of (anchor, experiment) prefixes
+        :return: Dictionary vp->(anchor, experiment)->set(AS paths to the anchor prefix) of diverged prefix pairs
+        """
+        diverged = defaultdict(dict)
+        for vp, routes in self.read_vp_routes(day).items():
+            for p_a, p_e in prefix_pairs:
+                if p_a not in routes or p_e not in routes:
+                    continue
+                anchor_paths = set(routes[p_a].values())
+                if anchor_paths != set(routes[p_e].values()) or len(routes[p_a]) != len(routes[p_e]):
+                    diverged[vp][(p_a, p_e)] = anchor_paths
+        return diverged
+
+
+class PostgresSink(RouteChangesStore):
+    """
+    Writes results to the raw_data, exp5_case_1 and exp5_case_1_vp_stats tables of a Postgres server, over a single
+    connection that is committed on close. With route_changes, routes are stored as changes instead of raw_data rows.
+    """
+    placeholder = '%s'
+
+    def __init__(self, db_config, route_changes=False):
+        import psycopg2
+        self.conn = psycopg2.connect(get_connect_str_from_config(db_config))
+        self.cursor = self.conn.cursor()
+        self.route_changes = route_changes
+        if route_changes:
+            self._create_route_changes_tables()
+
+    def insert_raw_data(self, raw_data):
+        if self.route_changes:
+            self.insert_route_changes(raw_data)
+            return
+        self._insert_into_table([raw_data_to_str(rd) for rd in raw_data], 'raw_data')
+
+    def insert_case_results(self, case_results):
+        """
+        :param case_results: Dictionary result table->list of result rows
+        """
+        for tablename, rows in case_results.items():
+            if rows:
+                sql_insert = "INSERT INTO " + tablename + " VALUES (" + ", ".join(["%s"] * len(rows[0])) + ")"
+                self.cursor.executemany(sql_insert, rows)
+
+    def _insert_into_table(self, args_str, tablename):
+        for arg in args_str:
+            sql_insert = "INSERT INTO " + tablename + " VALUES (" + arg + ")"
+            self.cursor.execute(sql_insert)
+
+    def marked_vps(self, tablename):
+        self.cursor.execute("SELECT vp_asn, vp_ip FROM " + tablename + ";")
+        return set(self.cursor.fetchall())
+
+    def data_days(self, vp_asn, vp_ip):
+        if self.route_changes:
+            return self.route_changes_data_days(vp_asn, vp_ip)
+        sql_select = "SELECT DISTINCT day FROM raw_data WHERE (vp_asn = {0} AND vp_ip = '{1}')".format(vp_asn, vp_ip)
+        self.cursor.execute(sql_select)
+        return set([res[0].strftime("%Y-%m-%d") for res in self.cursor.fetchall()])
+
+    def marked_days(self, tablename, vp_asn, vp_ip):
+        sql_select = "SELECT DISTINCT day FROM " + tablename
+        sql_select += " WHERE (vp_asn = {0} AND vp_ip = '{1}')".format(vp_asn, vp_ip)
+        self.cursor.execute(sql_select)
+        return set([res[0].strftime("%Y-%m-%d") for res in self.cursor.fetchall()])
+
+    def marked_prefix_pairs(self, tablename, vp_asn, vp_ip, day):
+        sql_select = "SELECT anchor_prefix, experiment_prefix FROM " + tablename + " "
+        sql_select += "WHERE (vp_asn = {0} AND vp_ip = '{1}' AND day = '{2}');".format(vp_asn, vp_ip, day)
+        self.cursor.execute(sql_select)
+        return self.cursor.fetchall()
+
+    def upsert_vp_stats(self, tablename, vp_asn, vp_ip, data_dates, marked_dates, marked_ratio, latest_measured,
+                        latest_marked, notes):
+        sql_insert_stats = "INSERT INTO " + tablename + " VALUES "
+        sql_insert_stats += "({0}, '{1}', {2}, {3}, {4}, '{5}', '{6}')".format(vp_asn, vp_ip, data_dates,
+                                                                               marked_dates, marked_ratio,
+                                                                               latest_measured, latest_marked)
+        sql_insert_stats += " ON CONFLICT ON CONSTRAINT vp_unique "
+        sql_insert_stats += " DO UPDATE SET data_dates = {0},".format(data_dates)
+        sql_insert_stats += " marked_dates = {0},".format(marked_dates)
+        sql_insert_stats += " marked_ratio = {0},".format(marked_ratio)
+        sql_insert_stats += " last_marked = '{0}',".format(latest_marked)
+        sql_insert_stats += " last_measured = '{0}';".format(latest_measured)
+        self.cursor.execute(sql_insert_stats)
+
+        sql_update = "UPDATE " + tablename + " "
+        sql_update += "SET notes = '{0}' WHERE (vp_asn = {1} AND vp_ip = '{2}');".format(notes, vp_asn, vp_ip)
+        self.cursor.execute(sql_update)
+
+    def close(self):
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS raw_data (
+    day TEXT, timestamp INTEGER, project TEXT, collector TEXT, vp_asn INTEGER, vp_ip TEXT, prefix TEXT,
+    as_path TEXT, path_len INTEGER, origin_asn INTEGER, communities TEXT);
+CREATE INDEX IF NOT EXISTS raw_data_vp_day ON raw_data (vp_asn, vp_ip, day);
+
+CREATE TABLE IF NOT EXISTS exp5_case_1 (
+    day TEXT, vp_asn INTEGER, vp_ip TEXT, anchor_prefix TEXT, experiment_prefix TEXT);
+CREATE INDEX IF NOT EXISTS exp5_case_1_vp_day ON exp5_case_1 (vp_asn, vp_ip, day);
+
+CREATE TABLE IF NOT EXISTS exp5_case_1_vp_stats (
+    vp_asn INTEGER, vp_ip TEXT, data_dates INTEGER, marked_dates INTEGER, marked_ratio REAL, last_measured TEXT,
+    last_marked TEXT, notes TEXT,
+    CONSTRAINT vp_unique UNIQUE (vp_asn, vp_ip));
+"""
+
+
+class SQLiteSink(RouteChangesStore):
+    """
+    Writes the same tables as PostgresSink to a local SQLite database file, which is created if it does not exist.
+    All writes of a run happen in one transaction that is committed on close.
+    """
+    placeholder = '?'
+
+    def __init__(self, filename, route_changes=False):
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.cursor = self.conn.cursor()
+        self.route_changes = route_changes
+        if route_changes:
+            self._create_route_changes_tables()
+
+    def insert_raw_data(self, raw_data):
+        if self.route_changes:
+            self.insert_route_changes(raw_data)
+            return
+        self.cursor.executemany("INSERT INTO raw_data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (rd[:10] + (None if rd[10] == 'NULL' else rd[10],) for rd in raw_data))
+
+    def insert_case_results(self, case_results):
+        """
+        :param case_results: Dictionary result table->list of result rows
+        """
+        for tablename, rows in case_results.items():
+            if rows:
+                sql_insert = "INSERT INTO " + tablename + " VALUES (" + ", ".join(["?"] * len(rows[0])) + ")"
+                self.cursor.executemany(sql_insert, rows)
+
+    def marked_vps(self, tablename):
+        self.cursor.execute("SELECT vp_asn, vp_ip FROM " + tablename)
+        return set(self.cursor.fetchall())
+
+    def data_days(self, vp_asn, vp_ip):
+        if self.route_changes:
+            return self.route_changes_data_days(vp_asn, vp_ip)
+        self.cursor.execute("SELECT DISTINCT day FROM raw_data WHERE vp_asn = ? AND vp_ip = ?", (vp_asn, vp_ip))
+        return set([res[0] for res in self.cursor.fetchall()])
+
+    def marked_days(self, tablename, vp_asn, vp_ip):
+        self.cursor.execute("SELECT DISTINCT day FROM " + tablename + " WHERE vp_asn = ? AND vp_ip = ?",
+                            (vp_asn, vp_ip))
+        return set([res[0] for res in self.cursor.fetchall()])
+
+    def marked_prefix_pairs(self, tablename, vp_asn, vp_ip, day):
+        self.cursor.execute("SELECT anchor_prefix, experiment_prefix FROM " + tablename + " "
+                            "WHERE vp_asn = ? AND vp_ip = ? AND day = ?", (vp_asn, vp_ip, day))
+        return self.cursor.fetchall()
+
+    def upsert_vp_stats(self, tablename, vp_asn, vp_ip, data_dates, marked_dates, marked_ratio, latest_measured,
+                        latest_marked, notes):
+        self.cursor.execute("INSERT INTO " + tablename + " VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT (vp_asn, vp_ip) DO UPDATE SET data_dates = excluded.data_dates, "
+                            "marked_dates = excluded.marked_dates, marked_ratio = excluded.marked_ratio, "
+                            "last_marked = excluded.last_marked, last_measured = excluded.last_measured, "
+                            "notes = excluded.notes",
+                            (vp_asn, vp_ip, data_dates, marked_dates, marked_ratio, latest_measured, latest_marked,
+                             notes))
+
+    def close(self):
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
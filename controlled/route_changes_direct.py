@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import sys
+import os
 import argparse
 from collections import defaultdict
 import reuter_util.bgp as bgp
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import bgp_records
 
 
 def parse_arguments(args):
@@ -23,6 +26,7 @@ ANCHOR_EXPERIMENT_PAIRS = [('147.28.240.0/24', '147.28.241.0/24'),
 
 def main(args):
     args = parse_arguments(args)
+    record_fields = ['prefix', 'as_path', 'peer_ip', 'peer_asn']
 
     for pair in ANCHOR_EXPERIMENT_PAIRS:
         anchor = pair[0]
@@ -33,16 +37,8 @@ def main(args):
         experiment_direct_paths = defaultdict(int)
         monitors = set()
 
-        with open(args.data, 'r') as f:
-            for line in f:
-                line = line.split('|')
-                if not (line[0] == 'R' and line[1] == 'R'):
-                    continue
-
-                prefix = line[7].rstrip()
-                as_path = line[9].rstrip()
-                peer_ip = line[6].rstrip()
-                peer_asn = line[5].rstrip()
+        with open(args.data, 'rb') as f:
+            for prefix, as_path, peer_ip, peer_asn in bgp_records.decode_records(f, record_fields, pair):
                 monitor = (peer_asn, peer_ip)
                 monitors.add(monitor)
                 if len(as_path.split(' ')) == 2:
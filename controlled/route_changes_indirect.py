@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 import sys
+import os
 import argparse
 from collections import defaultdict
 import reuter_util.bgp as bgp
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import bgp_records
+from result_sinks import SQLiteSink
 
 
 def parse_arguments(args):
     parser = argparse.ArgumentParser()
-    parser.add_argument("data", help="bgp data")
-    return parser.parse_args(args)
+    parser.add_argument("data", nargs='?', help="bgp data")
+    parser.add_argument("--history", help="SQLite DB written by controlled_rov_classification.py --route-changes. "
+                                          "If given, VPs whose paths diverged on --day are read from it instead of "
+                                          "from data, with the same rule. The history only holds the prefixes of "
+                                          "the experiment configs, one route per VP, prefix and hour, with AS path "
+                                          "prepending removed, so paths are counted per hour instead of per RIB "
+                                          "entry")
+    parser.add_argument("--day", help="Day to read from --history. Format %%Y-%%m-%%d")
+    args = parser.parse_args(args)
+    if args.history is None and args.data is None:
+        parser.error("data or --history is required")
+    if args.history is not None and args.day is None:
+        parser.error("--history requires --day")
+    return args
 
 
 ANCHOR_EXPERIMENT_PAIRS = [('147.28.240.0/24', '147.28.241.0/24'),
@@ -20,8 +36,26 @@ ANCHOR_EXPERIMENT_PAIRS = [('147.28.240.0/24', '147.28.241.0/24'),
                            ('147.28.252.0/24', '147.28.253.0/24'),
                            ('147.28.254.0/24', '147.28.255.0/24')
                            ]
+
+
+def print_diverged_vps_from_history(filename, day):
+    history = SQLiteSink(filename, route_changes=True)
+    diverged = history.diverged_vps(day, ANCHOR_EXPERIMENT_PAIRS)
+    for pair in ANCHOR_EXPERIMENT_PAIRS:
+        print("Anchor: {0} ; Experiment: {1}".format(pair[0], pair[1]))
+        for vp in diverged:
+            if pair in diverged[vp]:
+                print(str(vp[0]) + '|' + vp[1] + "|" + str(diverged[vp][pair]))
+        print("========================")
+    history.close()
+
+
 def main(args):
     args = parse_arguments(args)
+    if args.history:
+        print_diverged_vps_from_history(args.history, args.day)
+        return
+    record_fields = ['prefix', 'as_path', 'peer_ip', 'peer_asn']
 
     for pair in ANCHOR_EXPERIMENT_PAIRS:
         anchor = pair[0]
@@ -34,16 +68,8 @@ def main(args):
         experiment_paths = defaultdict(set)
         monitors = set()
 
-        with open(args.data, 'r') as f:
-            for line in f:
-                line = line.split('|')
-                if not (line[0] == 'R' and line[1] == 'R'):
-                    continue
-
-                prefix = line[7].rstrip()
-                as_path = line[9].rstrip()
-                peer_ip = line[6].rstrip()
-                peer_asn = line[5].rstrip()
+        with open(args.data, 'rb') as f:
+            for prefix, as_path, peer_ip, peer_asn in bgp_records.decode_records(f, record_fields, pair):
                 monitor = (peer_asn, peer_ip)
                 monitors.add(monitor)
                 if prefix == anchor:
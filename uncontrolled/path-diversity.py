@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import sys
+import os
 import argparse
 import csv
 import reuter_util.bgp as bgp
 import reuter_util.general as gen
+import rpki_validation
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import bgp_records
 
 
 def parse_arguments(args):
@@ -11,6 +15,8 @@ def parse_arguments(args):
     # format is: <dump-type>|<elem-type>|<record-ts>|<project>|<collector>|<peer-ASn>|<peer-IP>|
     # <prefix>|<next-hop-IP>|<AS-path>|<origin-AS>|<communities>|<old-state>|<new-state>|<validity-state>
     parser.add_argument("data", help="BGP RIB dump")
+    parser.add_argument("--vrps", help="VRP CSV file. If given, data is annotated with validity states while reading "
+                                       "it. See rpki_validation.py")
     args = parser.parse_args(args)
     return args
 
@@ -49,40 +55,37 @@ def write_path_diversities_to_file(path_diversities, filename):
                 datawriter.writerow(row)
 
 
-def gather_paths(filename):
+def gather_paths(filename, vrps_filename=None):
     print("Gathering paths from data")
     paths = {}
-    with open(filename, 'r') as f:
-        for line in f:
-            if not bgp.is_relevant_line(line, ['\n', '/']):
-                continue
-            bgp_fields = bgp.get_bgp_fields(line)
-            if not bgp.is_valid_bgp_entry(bgp_fields):
-                continue
-
-            monitor = (bgp_fields['peer_ip'], bgp_fields['peer_asn'])
-            as_path = bgp.remove_prepending_from_as_path(bgp_fields['as_path'])
-            vstate = bgp_fields['vstate']
-
-            gen.init_dic_with(paths, monitor, {})
-            origin_p = gen.init_dic_with(paths[monitor], bgp_fields['origin'],
+    record_fields = ['peer_ip', 'peer_asn', 'prefix', 'as_path', 'origin', 'vstate']
+    for peer_ip, peer_asn, prefix, as_path, origin, vstate in bgp_records.decode_records(
+            rpki_validation.read_data_lines(filename, vrps_filename), record_fields, record_types=None):
+        if not bgp_records.is_valid_bgp_entry(prefix, as_path, origin):
+            continue
+
+        monitor = (peer_ip, peer_asn)
+        as_path = bgp.remove_prepending_from_as_path(as_path)
+
+        gen.init_dic_with(paths, monitor, {})
+        origin_p = gen.init_dic_with(paths[monitor], origin,
                                      {'non_invalid_paths': set(), 'invalid_len_paths': set(),
                                       'invalid_as_paths': set(),
                                       'invalid_as_and_len_paths': set()})
-            if vstate < 2:
-                origin_p['non_invalid_paths'].add(as_path)
-            elif vstate == 3:
-                origin_p['invalid_as_paths'].add(as_path)
-            elif vstate == 4:
-                origin_p['invalid_len_paths'].add(as_path)
-            elif vstate == 5:
-                origin_p['invalid_as_and_len_paths'].add(as_path)
+        if vstate < 2:
+            origin_p['non_invalid_paths'].add(as_path)
+        elif vstate == 3:
+            origin_p['invalid_as_paths'].add(as_path)
+        elif vstate == 4:
+            origin_p['invalid_len_paths'].add(as_path)
+        elif vstate == 5:
+            origin_p['invalid_as_and_len_paths'].add(as_path)
+        else:
+            if vstate == 2:
+                print("Found RIB entry with validity state 2. Please annotate data with more specific reasons(3-5)")
             else:
-                if vstate == 2:
-                    print("Found RIB entry with validity state 2. Please annotate data with more specific reasons(3-5)")
-                else:
-                    print("Found unrecognized recognized validity state '{0}'. Exiting".format(vstate))
-                sys.exit(-1)
+                print("Found unrecognized recognized validity state '{0}'. Exiting".format(vstate))
+            sys.exit(-1)
 
     print("Done reading")
     return paths
@@ -125,7 +128,7 @@ def get_path_diversities(paths):
 
 def main(args):
     args = parse_arguments(args)
-    paths = gather_paths(args.data)
+    paths = gather_paths(args.data, args.vrps)
     path_diversities = get_path_diversities(paths)
     write_path_diversities_to_file(path_diversities, 'path_diversity.csv')
 
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import csv
+import ipaddress
+from collections import defaultdict
+
+# Validity states, as expected in the last field of annotated BGP data
+VALID = 0
+UNKNOWN = 1
+INVALID = 2
+INVALID_ASN = 3
+INVALID_LENGTH = 4
+INVALID_ASN_AND_LENGTH = 5
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("vrps", help="CSV file with validated ROA payloads. Format is <prefix>,<max length>,<ASN> or "
+                                     "<ASN>,<prefix>,<max length>[,<trust anchor>] as exported by RPKI validators")
+    parser.add_argument("data", help="BGP RIB dump in bgpreader format")
+    parser.add_argument("output", nargs='?', help="Annotated BGP RIB dump. Default is stdout")
+    return parser.parse_args(args)
+
+
+def parse_prefix(prefix):
+    """
+    :param prefix: IPv4 or IPv6 prefix string, e.g. '147.28.240.0/24'
+    :return: (IP version, network address as int, prefix length)
+    """
+    address, prefix_len = prefix.split('/')
+    if ':' in address:
+        return 6, int(ipaddress.IPv6Address(address)), int(prefix_len)
+    a, b, c, d = address.split('.')
+    return 4, (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d), int(prefix_len)
+
+
+class VRPTable(object):
+    """
+    Validated ROA payloads, stored per IP version and prefix length as network address->list((ASN, max length)).
+    Looking up the VRPs covering a prefix only needs one dictionary lookup per VRP prefix length that is shorter or
+    equal, and the result is cached per prefix since RIB dumps contain every prefix once per vantage point.
+    """
+
+    def __init__(self):
+        self.tables = {4: defaultdict(lambda: defaultdict(list)), 6: defaultdict(lambda: defaultdict(list))}
+        self.prefix_lens = {4: [], 6: []}
+        self.covering_cache = {}
+
+    def add(self, prefix, max_len, asn):
+        version, network, prefix_len = parse_prefix(prefix)
+        bits = 32 if version == 4 else 128
+        network = network >> (bits - prefix_len) << (bits - prefix_len)
+        table = self.tables[version]
+        if prefix_len not in table:
+            self.prefix_lens[version] = sorted(list(table) + [prefix_len])
+        table[prefix_len][network].append((str(asn), int(max_len)))
+        self.covering_cache = {}
+
+    def covering_vrps(self, prefix):
+        """
+        :return: List of (ASN, max length) of all VRPs whose prefix covers prefix
+        """
+        covering = self.covering_cache.get(prefix)
+        if covering is not None:
+            return covering
+
+        version, network, prefix_len = parse_prefix(prefix)
+        bits = 32 if version == 4 else 128
+        table = self.tables[version]
+        covering = []
+        for vrp_len in self.prefix_lens[version]:
+            if vrp_len > prefix_len:
+                break
+            vrp_network = network >> (bits - vrp_len) << (bits - vrp_len)
+            vrps = table[vrp_len].get(vrp_network)
+            if vrps:
+                covering.extend(vrps)
+        self.covering_cache[prefix] = covering
+        return covering
+
+    def validate(self, prefix, origin):
+        """
+        Route origin validation as in RFC 6811. Invalid routes are further classified: if a covering VRP authorizes
+        the origin, the route is too specific (INVALID_LENGTH); else if a covering VRP allows the prefix length, the
+        origin is wrong (INVALID_ASN); else both are wrong (INVALID_ASN_AND_LENGTH).
+        :param prefix: Prefix string of the route
+        :param origin: Origin ASN of the route as string
+        :return: One of VALID, UNKNOWN, INVALID_ASN, INVALID_LENGTH, INVALID_ASN_AND_LENGTH
+        """
+        covering = self.covering_vrps(prefix)
+        if not covering:
+            return UNKNOWN
+
+        prefix_len = int(prefix[prefix.index('/') + 1:])
+        asn_match = False
+        len_match = False
+        for asn, max_len in covering:
+            if asn == origin:
+                if prefix_len <= max_len:
+                    return VALID
+                asn_match = True
+            elif prefix_len <= max_len:
+                len_match = True
+
+        if asn_match:
+            return INVALID_LENGTH
+        if len_match:
+            return INVALID_ASN
+        return INVALID_ASN_AND_LENGTH
+
+
+def read_vrps(filename):
+    """
+    Rows that do not contain a prefix (e.g. headers) are skipped.
+    :param filename: CSV file with validated ROA payloads, see parse_arguments
+    :return: VRPTable
+    """
+    vrps = VRPTable()
+    with open(filename, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for row in reader:
+            if len(row) < 3:
+                continue
+            row = [field.strip() for field in row]
+            if '/' in row[0]:
+                prefix, max_len, asn = row[0], row[1], row[2]
+            elif '/' in row[1]:
+                asn, prefix, max_len = row[0], row[1], row[2]
+            else:
+                continue
+            if asn.upper().startswith('AS'):
+                asn = asn[2:]
+            vrps.add(prefix, max_len, int(asn))
+    return vrps
+
+
+def annotate_lines(lines, vrps):
+    """
+    Appends the validity state to every RIB entry of a bgpreader dump. Other lines are passed through unchanged.
+    :param lines: Iterable of lines in bgpreader format, as bytes
+    :param vrps: VRPTable
+    :return: Generator of annotated lines
+    """
+    for line in lines:
+        fields = line.split(b'|', 11)
+        if len(fields) < 12 or fields[0] != b'R' or b'/' not in fields[7]:
+            yield line
+            continue
+        vstate = vrps.validate(fields[7].decode(), fields[10].decode())
+        yield b'%s|%d\n' % (line.rstrip(b'\n'), vstate)
+
+
+def read_data_lines(filename, vrps_filename=None):
+    """
+    Lines of a BGP RIB dump, as bytes. If vrps_filename is given, the dump is annotated with validity states while
+    reading it, otherwise it must already be annotated.
+    """
+    with open(filename, 'rb') as f:
+        if vrps_filename is None:
+            yield from f
+        else:
+            yield from annotate_lines(f, read_vrps(vrps_filename))
+
+
+def main(args):
+    args = parse_arguments(args)
+    vrps = read_vrps(args.vrps)
+    with open(args.data, 'rb') as f:
+        if args.output is None:
+            sys.stdout.buffer.writelines(annotate_lines(f, vrps))
+        else:
+            with open(args.output, 'wb') as out:
+                out.writelines(annotate_lines(f, vrps))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
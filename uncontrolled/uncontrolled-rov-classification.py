@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 import sys
+import os
 import argparse
 import csv
-from collections import defaultdict
+from collections import defaultdict, Counter
 import reuter_util.general as gen
 import reuter_util.bgp as bgp
+import rpki_validation
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import bgp_records
 import time
 import random
+import math
 
 
 def timeit(method):
@@ -32,37 +37,50 @@ def parse_arguments(args):
     parser.add_argument("as_relationship", help="CAIDAs AS relationship file. Filename format is as_rel_<date>.txt")
     parser.add_argument("data", help="BGP RIB Data. Must be the same data as was used for generation of path_diversity")
     parser.add_argument("random_sets", type=int, help="Number of random sets of vantage points to run with")
+    parser.add_argument("--vrps", help="VRP CSV file. If given, data is annotated with validity states while reading "
+                                       "it. See rpki_validation.py")
+    parser.add_argument("--nested", action="store_true", help="Grow each random set of vantage points through all "
+                                                               "sample sizes instead of drawing independent sets")
+    parser.add_argument("--dense", action="store_true", help="Use every sample size from 1 to all vantage points")
+    parser.add_argument("--local-enforcers", action="store_true", help="Also find ROV enforcers per vantage point "
+                                                                        "(written to results/*_rov_enforcers.txt)")
+    parser.add_argument("--ci-width", type=float, help="Adaptive mode: Keep drawing sets of a sample size until the "
+                                                       "95%% confidence intervals of all results are at most this "
+                                                       "wide. random_sets is then the maximum number of sets per size")
+    parser.add_argument("--min-sets", type=int, default=5, help="Adaptive mode: Minimum number of sets per size")
+    parser.add_argument("--time-budget", type=float, help="Adaptive mode: Stop drawing sets after this many seconds")
     return parser.parse_args(args)
 
 
-def find_multiple_origin_enforcers(global_rov_enforcers_map, local_rov_enforcers_map):
-    # Each divergent AS with at least 3 origins is flagged as ROV enforcing
-    global_rov_enforcers = set()
-    for div_as in global_rov_enforcers_map:
-        if len(global_rov_enforcers_map[div_as]) >= 3:
-            global_rov_enforcers.add(div_as)
-
+def find_multiple_origin_enforcers(monitor_candidates):
+    """
+    :param monitor_candidates: Dictionary (monitor, rov_candidate)->set(origin), see find_rov_candidates
+    :return: global_rov_enforcers: set of AS flagged for at least 3 origins by any monitors
+    :return: local_rov_enforcers: Dictionary monitor->set(AS) flagged for at least 3 origins by that monitor
+    """
+    candidate_origins = defaultdict(set)
     local_rov_enforcers = defaultdict(set)
-    for monitor in local_rov_enforcers_map:
-        for div_as in local_rov_enforcers_map[monitor]:
-            if len(local_rov_enforcers_map[monitor][div_as]) >= 3:
-                local_rov_enforcers[monitor].add(div_as)
+    for (monitor, rov_candidate), origins in monitor_candidates.items():
+        candidate_origins[rov_candidate].update(origins)
+        if len(origins) >= 3:
+            local_rov_enforcers[monitor].add(rov_candidate)
+
+    # Each AS with at least 3 origins is flagged as ROV enforcing
+    global_rov_enforcers = set(rov_candidate for rov_candidate, origins in candidate_origins.items()
+                               if len(origins) >= 3)
     return global_rov_enforcers, local_rov_enforcers
 
 
 def write_rov_enforcers_to_file(global_rov_enforcers, local_rov_enforcers):
     gen.make_dirs('results')
     with open('results/global_rov_enforcers.txt', 'w') as f:
-        for rov_enforcer in global_rov_enforcers:
+        for rov_enforcer in sorted(global_rov_enforcers):
             f.write(rov_enforcer + '\n')
 
+    # One line per monitor that has local ROV enforcers: <monitorIP>,<monitorAS> <AS> <AS> ...
     with open('results/local_rov_enforcers.txt', 'w') as f:
-        for monitor in local_rov_enforcers:
-            line = monitor[0] + ',' + monitor[1]
-            for rov_enforcer in local_rov_enforcers[monitor]:
-                line += ' ' + rov_enforcer
-            line += '\n'
-            f.write(line)
+        for monitor in sorted(local_rov_enforcers):
+            f.write(monitor[0] + ',' + monitor[1] + ' ' + ' '.join(sorted(local_rov_enforcers[monitor])) + '\n')
 
 
 def write_analysis_results_to_file(vp_set, non_rov, rov_cand, rov_enf, false_rov_cand, false_rov_enf, filename, mode):
@@ -87,12 +105,85 @@ def find_rov_enforcing_as(rov_candidate_set):
     return rov_enforcing
 
 
-def find_rov_candidates(vantage_point_set, special_origin_paths, non_rov_enforcing):
+def index_special_origin_paths(special_origin_paths):
+    """
+    Groups the paths to each special origin into an inverted index: for every AS seen on an invalid path to the origin,
+    a bitmask of the invalid paths it appears on. This lets find_rov_candidates check a non-invalid path against all
+    invalid paths to the same origin at once, instead of comparing every pair of paths.
+    :param special_origin_paths: Dictionary vantage_point->origin->{set(invalid_paths), set(non_invalid_paths)}
+    :return: Dictionary vantage_point->origin->(list(set(non_invalid_path_AS)), Dictionary AS->invalid_path_bitmask,
+             bitmask of all invalid paths)
+    """
+    origin_path_index = defaultdict(dict)
+    for vantage_point in special_origin_paths:
+        for origin, paths in special_origin_paths[vantage_point].items():
+            invalid_paths = paths.get('invalid', ())
+            non_invalid_paths = paths.get('non_invalid', ())
+            if not invalid_paths or not non_invalid_paths:
+                continue
+
+            origins = set()
+            invalid_path_masks = defaultdict(int)
+            for i, invalid_path in enumerate(sorted(invalid_paths)):
+                inv_tmp = invalid_path.split(' ')
+                origins.add(inv_tmp[-1])
+                for asn in inv_tmp:
+                    invalid_path_masks[asn] |= 1 << i
+
+            non_invalid_path_sets = []
+            for non_invalid_path in non_invalid_paths:
+                non_inv_tmp = non_invalid_path.split(' ')
+                origins.add(non_inv_tmp[-1])
+                non_invalid_path_sets.append(frozenset(non_inv_tmp))
+
+            if len(origins) != 1:
+                print("ERROR: Paths don't have same origin!`")
+                sys.exit()
+
+            all_invalid_mask = (1 << len(invalid_paths)) - 1
+            origin_path_index[vantage_point][origin] = (non_invalid_path_sets, dict(invalid_path_masks),
+                                                        all_invalid_mask)
+    return origin_path_index
+
+
+def find_origin_rov_candidates(non_invalid_path_sets, invalid_path_masks, all_invalid_mask, non_rov_enforcing):
+    """
+    An AS on a non-invalid path is a ROV candidate if there is an invalid path to the same origin that contains every
+    other AS of the non-invalid path that is not non-ROV enforcing, but not the AS itself.
+    :param non_invalid_path_sets: List of sets of AS, one per non-invalid path to the origin
+    :param invalid_path_masks: Dictionary AS->bitmask of invalid paths to the origin the AS appears on
+    :param all_invalid_mask: Bitmask with one bit set for each invalid path to the origin
+    :param non_rov_enforcing: Set of non-ROV enforcing AS
+    :return: set of ROV candidates for this origin
+    """
+    rov_candidates = set()
+    for non_invalid_as in non_invalid_path_sets:
+        divergent = [asn for asn in non_invalid_as if asn not in non_rov_enforcing]
+        masks = [invalid_path_masks.get(asn, 0) for asn in divergent]
+
+        # suffix[i] holds the invalid paths containing all of divergent[i:]
+        suffix = [all_invalid_mask] * (len(masks) + 1)
+        for i in range(len(masks) - 1, -1, -1):
+            suffix[i] = suffix[i + 1] & masks[i]
+
+        # prefix holds the invalid paths containing all of divergent[:i]
+        prefix = all_invalid_mask
+        for i, mask in enumerate(masks):
+            if prefix & suffix[i + 1] & ~mask:
+                rov_candidates.add(divergent[i])
+            prefix &= mask
+            if not prefix:
+                break
+    return rov_candidates
+
+
+def find_rov_candidates(vantage_point_set, origin_path_index, non_rov_enforcing, monitor_candidates=None):
     """
     :param vantage_point_set: Set of vantage points for which to find ROV candidates
-    :param special_origin_paths: Dictionary with paths to special origins.
-    vantage_point->origin->{set(invalid_paths), set(non_invalid_paths)}
+    :param origin_path_index: Index of paths to special origins, see index_special_origin_paths
     :param non_rov_enforcing: Dictionary with vantage_point->set(non-ROV enforcing AS)
+    :param monitor_candidates: If given, Dictionary (monitor, rov_candidate)->set(origin) to which the candidates are
+                               also added per monitor that flagged them
     :return: For each vantage point, for each origin, set of AS that possibly enforce ROV on the origins prefixes
     :return: All 'non_rov_enforcing' AS observed by the monitors in monitor_set
     """
@@ -100,54 +191,38 @@ def find_rov_candidates(vantage_point_set, special_origin_paths, non_rov_enforci
     # First join all non_rov_enforcing sets
     total_non_rov_enforcing = set()
     for vantage_point in vantage_point_set:
-        total_non_rov_enforcing = total_non_rov_enforcing.union(non_rov_enforcing[vantage_point])
+        total_non_rov_enforcing.update(non_rov_enforcing[vantage_point])
 
-    # Then go through all paths, for each origin find ROV candidates. Store in Dictionary: rov_candidate_AS->set(origin)
+    # Then go through all origins, for each origin find ROV candidates. Store in Dictionary: rov_candidate_AS->set(origin)
+    # A candidate is an AS that is the only AS (apart from non-ROV enforcing ones) on a non-invalid path that is
+    # missing from an invalid path to the same origin.
     rov_candidate_set = defaultdict(set)
     for vantage_point in vantage_point_set:
-        for origin in special_origin_paths[vantage_point]:
-            non_invalid_paths = special_origin_paths[vantage_point][origin]['non_invalid']
-
-            # Compare each invalid path to each non-invalid path
-            for invalid_path in special_origin_paths[vantage_point][origin]['invalid']:
-                for non_invalid_path in non_invalid_paths:
-
-                    # If they are the same, we can't flag any AS
-                    if invalid_path == non_invalid_path:
-                        continue
-
-                    # Get all AS that are different. Then discard those who are non-ROV enforcing.
-                    # If there is exactly one AS left, then tag it as ROV candidate
-                    inv_tmp = invalid_path.split(' ')
-                    inv_tmp.reverse()
-                    non_inv_tmp = non_invalid_path.split(' ')
-                    non_inv_tmp.reverse()
-                    if inv_tmp[0] != non_inv_tmp[0]:
-                        print("ERROR: Paths don't have same origin!`")
-                        sys.exit()
-
-                    possible_rov_cand = set(non_inv_tmp).difference(set(inv_tmp))
-                    possible_rov_cand = possible_rov_cand.difference(total_non_rov_enforcing)
-                    if len(possible_rov_cand) == 1:
-                        rov_candidate_set[possible_rov_cand.pop()].add(origin)
+        for origin, origin_index in origin_path_index.get(vantage_point, {}).items():
+            for rov_candidate in find_origin_rov_candidates(*origin_index, total_non_rov_enforcing):
+                rov_candidate_set[rov_candidate].add(origin)
+                if monitor_candidates is not None:
+                    monitor_candidates[(vantage_point, rov_candidate)].add(origin)
 
     return rov_candidate_set, total_non_rov_enforcing
 
 
-def do_analysis_for_vantage_point_set(vantage_point_set, special_origin_path_sets, non_rov_enforcing_sets):
+def do_analysis_for_vantage_point_set(vantage_point_set, origin_path_index, non_rov_enforcing_sets,
+                                      monitor_candidates=None):
     """
     Flags AS as 'non ROV enforcing', 'ROV enforcing candidate', and 'ROV enforcing'. Only considers AS from paths
     that were observed by vantage points in vantage_point_set
     :param vantage_point_set: set of vantage_point
-    :param special_origin_path_sets: Dictionary vantage_point->origin->{set(invalid_paths}, set(non_invalid_paths)}
+    :param origin_path_index: Index of paths to special origins, see index_special_origin_paths
     :param non_rov_enforcing_sets: Dictionary vantage_point->set(non-ROV enforcing AS)
+    :param monitor_candidates: see find_rov_candidates
     :return: non_rov_enforcing: set of 'non ROV enforcing' AS as seen by vantage point in vantage_point_set
     :return: rov_candidates: set of AS that are candidates for ROV enforcement (i.e. flagged by at least 1 origin)
     :return: rov_enforcing: set of AS that are flagged as 'ROV enforcing' (i.e. flagged by at least 3 origins)
     """
 
-    rov_candidates_dict, non_rov_enforcing = find_rov_candidates(vantage_point_set, special_origin_path_sets,
-                                                                 non_rov_enforcing_sets)
+    rov_candidates_dict, non_rov_enforcing = find_rov_candidates(vantage_point_set, origin_path_index,
+                                                                 non_rov_enforcing_sets, monitor_candidates)
 
     rov_enforcing = find_rov_enforcing_as(rov_candidates_dict)
     rov_candidates = set(rov_candidates_dict.keys())
@@ -155,48 +230,264 @@ def do_analysis_for_vantage_point_set(vantage_point_set, special_origin_path_set
     return non_rov_enforcing, rov_candidates, rov_enforcing
 
 
+class IncrementalVantagePointAnalysis(object):
+    """
+    Same classification as do_analysis_for_vantage_point_set, but updated as vantage points are added one at a time.
+    Adding a vantage point only re-evaluates the origins whose non-invalid paths contain a newly found non-ROV
+    enforcing AS, plus the origins of the new vantage point itself.
+    """
+
+    def __init__(self, origin_path_index, non_rov_enforcing_sets):
+        """
+        :param origin_path_index: Index of paths to special origins, see index_special_origin_paths
+        :param non_rov_enforcing_sets: Dictionary vantage_point->set(non-ROV enforcing AS)
+        """
+        self.origin_path_index = origin_path_index
+        self.non_rov_enforcing_sets = non_rov_enforcing_sets
+        self.vantage_points = set()
+        self.non_rov_enforcing = set()
+        # (vantage_point, origin)->set(rov_candidate)
+        self.origin_candidates = {}
+        # rov_candidate->origin->number of vantage points flagging it for that origin
+        self.candidate_origins = defaultdict(Counter)
+        # AS->set((vantage_point, origin)) with the AS on a non-invalid path
+        self.non_invalid_as_keys = defaultdict(set)
+
+    def add_vantage_point(self, vantage_point):
+        if vantage_point in self.vantage_points:
+            return
+        self.vantage_points.add(vantage_point)
+
+        new_non_rov_enforcing = self.non_rov_enforcing_sets.get(vantage_point, set()) - self.non_rov_enforcing
+        self.non_rov_enforcing.update(new_non_rov_enforcing)
+
+        # Candidates only change where a new non-ROV enforcing AS is on a non-invalid path
+        dirty_keys = set()
+        for asn in new_non_rov_enforcing:
+            dirty_keys.update(self.non_invalid_as_keys.pop(asn, ()))
+
+        for origin, origin_index in self.origin_path_index.get(vantage_point, {}).items():
+            key = (vantage_point, origin)
+            for non_invalid_as in origin_index[0]:
+                for asn in non_invalid_as:
+                    if asn not in self.non_rov_enforcing:
+                        self.non_invalid_as_keys[asn].add(key)
+            dirty_keys.add(key)
+
+        for key in dirty_keys:
+            self._update_origin_candidates(key)
+
+    def _update_origin_candidates(self, key):
+        vantage_point, origin = key
+        old_candidates = self.origin_candidates.get(key, set())
+        new_candidates = find_origin_rov_candidates(*self.origin_path_index[vantage_point][origin],
+                                                    self.non_rov_enforcing)
+
+        for rov_candidate in old_candidates - new_candidates:
+            origins = self.candidate_origins[rov_candidate]
+            origins[origin] -= 1
+            if not origins[origin]:
+                del origins[origin]
+            if not origins:
+                del self.candidate_origins[rov_candidate]
+
+        for rov_candidate in new_candidates - old_candidates:
+            self.candidate_origins[rov_candidate][origin] += 1
+
+        self.origin_candidates[key] = new_candidates
+
+    def rov_candidates(self):
+        return set(self.candidate_origins)
+
+    def rov_enforcing(self):
+        return set(rov_candidate for rov_candidate, origins in self.candidate_origins.items() if len(origins) >= 3)
+
+
+def write_sample_results(vantage_point_set, non_rov, rov_cand, rov_enf, global_non_rov_enforcing, results_file):
+    """
+    Writes the results for a sample of vantage points to results_file
+    :return: Tuple with the number of non-ROV AS, ROV candidates, ROV enforcers, false positive ROV candidates and false
+             positive ROV enforcers
+    """
+    # See how many of the ROV candidates and ROV enforcers are actually seen as non-ROV on a global scale
+    false_rov_cand = rov_cand.intersection(global_non_rov_enforcing)
+    false_rov_enf = rov_enf.intersection(global_non_rov_enforcing)
+
+    write_analysis_results_to_file(vantage_point_set, non_rov, rov_cand, rov_enf, false_rov_cand, false_rov_enf,
+                                   results_file, 'a')
+    return len(non_rov), len(rov_cand), len(rov_enf), len(false_rov_cand), len(false_rov_enf)
+
+
+def run_independent_sample(vantage_points, sample_size, known_sets, origin_path_index, non_rov_enforcing,
+                           global_non_rov_enforcing, results_file):
+    """
+    Draws a random set of sample_size vantage points that is not in known_sets and writes its results. known_sets
+    must not contain all math.comb(len(vantage_points), sample_size) possible sets yet
+    :return: see write_sample_results
+    """
+    # Pick random vantage points
+    random_vp_set = frozenset(random.sample(vantage_points, sample_size))
+    while random_vp_set in known_sets:
+        random_vp_set = frozenset(random.sample(vantage_points, sample_size))
+
+    known_sets.add(random_vp_set)
+    # Do analysis only with data from these vps
+    non_rov, rov_cand, rov_enf = do_analysis_for_vantage_point_set(random_vp_set, origin_path_index,
+                                                                   non_rov_enforcing)
+    return write_sample_results(random_vp_set, non_rov, rov_cand, rov_enf, global_non_rov_enforcing, results_file)
+
+
+def run_nested_sample(vantage_points, set_sample_sizes, origin_path_index, non_rov_enforcing,
+                      global_non_rov_enforcing, results_file):
+    """
+    Adds vantage points in random order and writes results whenever the set reaches one of the sample sizes. Each
+    sample thus extends the smaller ones and the whole size ladder costs about as much as the largest sample.
+    :return: Dictionary sample_size->results, see write_sample_results
+    """
+    vantage_points = list(vantage_points)
+    random.shuffle(vantage_points)
+    analysis = IncrementalVantagePointAnalysis(origin_path_index, non_rov_enforcing)
+    results = {}
+    added = 0
+    for sample_size in sorted(set_sample_sizes):
+        while added < sample_size:
+            analysis.add_vantage_point(vantage_points[added])
+            added += 1
+
+        results[sample_size] = write_sample_results(analysis.vantage_points, analysis.non_rov_enforcing,
+                                                    analysis.rov_candidates(), analysis.rov_enforcing(),
+                                                    global_non_rov_enforcing, results_file)
+    return results
+
+
+class RunningStats(object):
+    """
+    Running mean and variance of a metric (Welford's algorithm). exact is set if the samples cover all possible sets of
+    vantage points, so the mean is the exact value
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.exact = False
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def ci_width(self, z=1.96):
+        """
+        :return: Width of the normal approximation confidence interval of the mean (95% for z=1.96), 0 if exact
+        """
+        if self.exact:
+            return 0.0
+        if self.n < 2:
+            return float('inf')
+        return 2 * z * math.sqrt(self.m2 / (self.n - 1) / self.n)
+
+
+def write_sample_intervals_to_file(sample_stats, filename):
+    with open(filename, 'w') as f:
+        for sample_size in sorted(sample_stats):
+            stats = sample_stats[sample_size]
+            line = "{0}|{1}".format(sample_size, stats[0].n)
+            for metric_stats in stats:
+                line += "|{0:.2f}|{1:.2f}".format(metric_stats.mean, metric_stats.ci_width())
+            f.write(line + '\n')
+
+
+def run_adaptive_samples(vantage_points, set_sample_sizes, nested, ci_width, min_sets, max_sets, time_budget,
+                         origin_path_index, non_rov_enforcing, global_non_rov_enforcing, results_file):
+    """
+    Keeps drawing samples, one per sample size and round, until the confidence intervals of all reported metrics of a
+    sample size are at most ci_width wide (or max_sets samples were drawn for it), or time_budget seconds have passed.
+    In nested mode, each round is one nested sample up to the largest sample size that has not converged yet, of which
+    only the sizes that have not converged are recorded.
+    :return: Dictionary sample_size->list(RunningStats), one per metric of write_sample_results
+    """
+    start = time.time()
+    sample_stats = dict((sample_size, [RunningStats() for _ in range(5)]) for sample_size in set_sample_sizes)
+    known_sets = defaultdict(set)
+
+    def converged(sample_size):
+        stats = sample_stats[sample_size]
+        # Independent samples are distinct, so drawing all possible sets gives the exact value. Nested samples can
+        # repeat sets, only the set of all vantage points is always exact.
+        possible_sets = math.comb(len(vantage_points), sample_size)
+        if sample_size == len(vantage_points) or (not nested and stats[0].n >= possible_sets):
+            for metric_stats in stats:
+                metric_stats.exact = True
+        if stats[0].n >= min(max_sets, possible_sets):
+            return True
+        return stats[0].n >= min_sets and all(metric_stats.ci_width() <= ci_width for metric_stats in stats)
+
+    def add_results(sample_size, results):
+        for metric_stats, value in zip(sample_stats[sample_size], results):
+            metric_stats.add(value)
+
+    pending = list(set_sample_sizes)
+    while pending:
+        if nested:
+            for sample_size, results in run_nested_sample(vantage_points, pending, origin_path_index,
+                                                          non_rov_enforcing, global_non_rov_enforcing,
+                                                          results_file).items():
+                add_results(sample_size, results)
+        else:
+            for sample_size in pending:
+                if time_budget is not None and time.time() - start > time_budget:
+                    break
+                add_results(sample_size, run_independent_sample(vantage_points, sample_size, known_sets[sample_size],
+                                                                origin_path_index, non_rov_enforcing,
+                                                                global_non_rov_enforcing, results_file))
+
+        pending = [sample_size for sample_size in pending if not converged(sample_size)]
+        if time_budget is not None and time.time() - start > time_budget:
+            break
+    return sample_stats
+
+
 @timeit
-def read_bgp_paths(data_file, special_origins, p2c_data):
+def read_bgp_paths(data_file, special_origins, p2c_data, vrps_file=None):
     """
     For each vp, store all paths to special origins (separated by non_invalid, invalid). Also for each vp
     store all AS seen on invalid paths (except when origin is vp or customer of vp).
     :param data_file: BGP RIB file
     :param p2c_data: Dictionary providerAS->set(customerAS)
     :param special_origins: Dictionary vantage_point->set(special_origins)
+    :param vrps_file: VRP CSV file to annotate data_file with while reading it, if it is not annotated yet
     :return: special_origin_paths: Dictionary, vantage_point->origin->{set(invalid_paths), set(non_invalid_paths)}
     :return: non_rov_enforcing: Dictionary, vantage_point->set(non-ROV enforcing AS)
     """
     non_rov_enforcing = defaultdict(set)
     special_origin_paths = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
-    with open(data_file, 'r') as f:
-        for line in f:
-            if not bgp.is_relevant_line(line, ['\n', '/']):
-                continue
-            bgp_fields = bgp.get_bgp_fields(line)
-            if not bgp.is_valid_bgp_entry(bgp_fields):
-                continue
+    record_fields = ['peer_ip', 'peer_asn', 'prefix', 'as_path', 'origin', 'vstate']
+    for peer_ip, peer_asn, prefix, as_path, origin, vstate in bgp_records.decode_records(
+            rpki_validation.read_data_lines(data_file, vrps_file), record_fields, record_types=None):
+        if not bgp_records.is_valid_bgp_entry(prefix, as_path, origin):
+            continue
 
-            vantage_point = (bgp_fields['peer_ip'], bgp_fields['peer_asn'])
-            origin = bgp_fields['origin']
+        vantage_point = (peer_ip, peer_asn)
 
-            # Exclude announcements where vantage_point is origin or a customer of vantage_point is origin
-            if origin == vantage_point[1] or origin in p2c_data[vantage_point[1]]:
-                continue
+        # Exclude announcements where vantage_point is origin or a customer of vantage_point is origin
+        if origin == vantage_point[1] or origin in p2c_data[vantage_point[1]]:
+            continue
+
+        as_path = bgp.remove_prepending_from_as_path(as_path)
 
-            vstate = bgp_fields['vstate']
-            as_path = bgp.remove_prepending_from_as_path(bgp_fields['as_path'])
+        if vstate > 2:
+            # If invalid, add all AS on path except origin to 'non-ROV enforcing'
+            for asn in as_path.split(' ')[:-1]:
+                non_rov_enforcing[vantage_point].add(asn.rstrip())
 
+        # If its a special origin, store its path
+        if origin in special_origins[vantage_point]:
             if vstate > 2:
-                # If invalid, add all AS on path except origin to 'non-ROV enforcing'
-                for asn in as_path.split(' ')[:-1]:
-                    non_rov_enforcing[vantage_point].add(asn.rstrip())
-
-            # If its a special origin, store its path
-            if origin in special_origins[vantage_point]:
-                if vstate > 2:
-                    special_origin_paths[vantage_point][origin]['invalid'].add(as_path)
-                else:
-                    special_origin_paths[vantage_point][origin]['non_invalid'].add(as_path)
+                special_origin_paths[vantage_point][origin]['invalid'].add(as_path)
+            else:
+                special_origin_paths[vantage_point][origin]['non_invalid'].add(as_path)
     return special_origin_paths, non_rov_enforcing
 
 
@@ -265,14 +556,20 @@ def main(args):
     # For each vantage point, store 1) All paths to a special origin 2) all AS found on invalid paths to the vantage
     # point (except when vp or customer of vp is origin).
     # non_rov_enforcing is the AS that have been found on _any_ invalid path, grouped by vantage point
-    special_origin_paths, non_rov_enforcing = read_bgp_paths(args.data, special_origins, p2c_data)
+    special_origin_paths, non_rov_enforcing = read_bgp_paths(args.data, special_origins, p2c_data, args.vrps)
+    origin_path_index = index_special_origin_paths(special_origin_paths)
 
     # ------------------ Start of analysis -------------------
     # All vantage points
-    non_rov, rov_cand, rov_enf = do_analysis_for_vantage_point_set(all_vantage_points, special_origin_paths,
-                                                                   non_rov_enforcing)
+    monitor_candidates = defaultdict(set) if args.local_enforcers else None
+    non_rov, rov_cand, rov_enf = do_analysis_for_vantage_point_set(all_vantage_points, origin_path_index,
+                                                                   non_rov_enforcing, monitor_candidates)
     write_analysis_results_to_file(all_vantage_points, non_rov, rov_cand, rov_enf, set(), set(), results_file, 'a')
 
+    if args.local_enforcers:
+        global_rov_enforcers, local_rov_enforcers = find_multiple_origin_enforcers(monitor_candidates)
+        write_rov_enforcers_to_file(global_rov_enforcers, local_rov_enforcers)
+
     # ------------------  Analysis of vantage point groups ---
     # Global set of non-ROV enforcing AS, regardless of which vp saw it
     global_non_rov_enforcing = set()
@@ -280,25 +577,31 @@ def main(args):
         global_non_rov_enforcing = global_non_rov_enforcing.union(non_rov_enforcing[vantage_point])
 
     set_sample_sizes = [10, 20, 44, 60, 80, 100, 200, 300, 400, 500, 600, 700, 800, 900]
+    if args.dense:
+        set_sample_sizes = list(range(1, len(all_vantage_points) + 1))
+    vantage_points = sorted(all_vantage_points)
+    set_sample_sizes = [size for size in set_sample_sizes if size <= len(vantage_points)]
+
+    if args.ci_width is not None:
+        sample_stats = run_adaptive_samples(vantage_points, set_sample_sizes, args.nested, args.ci_width,
+                                            args.min_sets, args.random_sets, args.time_budget, origin_path_index,
+                                            non_rov_enforcing, global_non_rov_enforcing, results_file)
+        write_sample_intervals_to_file(sample_stats, 'results/analysis_intervals.txt')
+        return
+
+    if args.nested:
+        for i in range(0, args.random_sets):
+            run_nested_sample(vantage_points, set_sample_sizes, origin_path_index, non_rov_enforcing,
+                              global_non_rov_enforcing, results_file)
+        return
+
     for sample_size in set_sample_sizes:
         known_sets = set()
-        for i in range(0, args.random_sets):
-            # Pick random vantage points
-            random_vp_set = frozenset(random.sample(all_vantage_points, sample_size))
-            while random_vp_set in known_sets:
-                random_vp_set = frozenset(random.sample(all_vantage_points, sample_size))
-
-            known_sets.add(random_vp_set)
-            # Do analysis only with data from these vps
-            non_rov, rov_cand, rov_enf = do_analysis_for_vantage_point_set(random_vp_set, special_origin_paths,
-                                                             non_rov_enforcing)
-
-            # See how many of the ROV candidates and ROV enforcers are actually seen as non-ROV on a global scale
-            false_rov_cand = rov_cand.intersection(global_non_rov_enforcing)
-            false_rov_enf = rov_enf.intersection(global_non_rov_enforcing)
-
-            write_analysis_results_to_file(random_vp_set, non_rov, rov_cand, rov_enf, false_rov_cand, false_rov_enf
-                                           , results_file, 'a')
+        # There are only so many distinct sets of a sample size, e.g. one with all vantage points
+        for i in range(0, min(args.random_sets, math.comb(len(vantage_points), sample_size))):
+            run_independent_sample(vantage_points, sample_size, known_sets, origin_path_index, non_rov_enforcing,
+                                   global_non_rov_enforcing, results_file)
+
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))